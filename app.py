@@ -1,40 +1,64 @@
 import os
-import json
+import re
 import logging
+import orjson
 from datetime import datetime
+from pathlib import Path
 from dotenv import load_dotenv
 from flask import Flask, request, jsonify, send_from_directory, render_template, send_file
 from flask_cors import CORS
+from openai import OpenAI
 import webbrowser
-from threading import Timer
-
-# --- Import your core logic modules ---
-from story_generation import StoryGenerator
-from audio_generation import AudioModel
-from image_generation import ImageModel
-from video_synchronization import generate_video
+from threading import Timer, BoundedSemaphore, Lock
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Configuration and Initialization ---
+# Environment and logging are set up here only, before the core modules are
+# imported, since some of them read settings at import time.
 load_dotenv()
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+if not logging.getLogger().handlers:
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
 logger = logging.getLogger(__name__)
 
+# --- Import your core logic modules ---
+from story_generation import StoryGenerator
+from audio_generation import AudioModel
+from image_generation import ImageModel
+
 app = Flask(__name__)
 CORS(app)
 
 GENERATED_VIDEOS_DIR = "generated_videos"
 os.makedirs(GENERATED_VIDEOS_DIR, exist_ok=True)
 
+# Anything that is not a letter or digit is stripped from titles used as directory names
+_UNSAFE_TITLE_RE = re.compile(r"[\W_]+")
+
+# Upper bound on concurrent TTS/DALL-E calls per request (2 per scene, up to 10 scenes)
+ASSET_WORKERS = 16
+
+# Scene videos encoded concurrently per request while the remaining assets are generated
+ENCODE_WORKERS = 4
+
+# Caps in-flight TTS/DALL-E calls across all requests in this process, so
+# concurrent requests don't run into OpenAI's rate limits
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+_openai_slots = BoundedSemaphore(OPENAI_MAX_CONCURRENCY)
+
 # --- Initialize AI Clients ---
+# A single OpenAI client is shared by all models so they reuse one pool of
+# keep-alive connections instead of each opening their own.
 try:
-    story_generator_client = StoryGenerator(api_key=os.getenv("OPENAI_API_KEY"))
-    image_client = ImageModel()
-    audio_client = AudioModel()
+    openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    story_generator_client = StoryGenerator(client=openai_client)
+    image_client = ImageModel(client=openai_client)
+    audio_client = AudioModel(client=openai_client)
     logger.info("Initialized StoryGenerator, Audio, and Image clients successfully.")
 except Exception as e:
     logger.critical(f"Failed to initialize AI models: {e}", exc_info=True)
@@ -49,9 +73,98 @@ def serve_frontend():
 def serve_static(filename):
     return send_from_directory("static", filename)
 
+# --- Scene Asset Generation ---
+def create_output_dir(story_title):
+    """Creates a timestamped project directory for a story and returns (dir_name, output_dir)."""
+    safe_title = _UNSAFE_TITLE_RE.sub("", story_title) or "Untitled_Story"
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    dir_name = f"{safe_title}_{timestamp}"
+    output_dir = os.path.join(GENERATED_VIDEOS_DIR, dir_name)
+    os.makedirs(output_dir, exist_ok=True)
+    return dir_name, output_dir
+
+def _run_rate_limited(fn, *args):
+    """Runs fn(*args) once one of the shared OpenAI concurrency slots is free."""
+    with _openai_slots:
+        return fn(*args)
+
+def _call_when_done(futures, callback):
+    """
+    Calls callback(written) once every future has finished, provided at least one
+    succeeded. `written` is the set of file names returned by the successful futures.
+    """
+    remaining = len(futures)
+    lock = Lock()
+
+    def on_done(_):
+        nonlocal remaining
+        with lock:
+            remaining -= 1
+            if remaining:
+                return
+        written = {os.path.basename(future.result()) for future in futures if future.exception() is None}
+        if written:
+            callback(written)
+
+    for future in futures:
+        future.add_done_callback(on_done)
+
+def generate_scene_assets(scenes_data, format_type, output_dir, on_scene_ready=None):
+    """
+    Generates the narration audio and image for every scene concurrently.
+    Each TTS and DALL-E call is an independent, I/O-bound request, so they are
+    all dispatched to a thread pool instead of being made one after another.
+    `scenes_data` may be a lazy iterator (e.g. a StoryStream); each scene's
+    requests are submitted as soon as the scene is available.
+    If given, on_scene_ready(scene_num, written) is called as soon as all of a
+    scene's requests have finished and at least one succeeded, with the set of
+    asset file names that were written for it.
+
+    Returns:
+        Sorted list of scene numbers for which at least one asset was generated.
+    """
+    futures = []
+    with ThreadPoolExecutor(max_workers=ASSET_WORKERS) as executor:
+        for scene_num, scene in enumerate(scenes_data, 1):
+            narration = None
+            image_prompt = None
+
+            if format_type.lower() == "legacy":
+                narration = scene.get('narration')
+                image_prompt = scene.get('image_prompt')
+            elif 'media' in scene:
+                narration = scene['media'].get('audio_narration')
+                image_prompt = scene['media'].get('image_prompt')
+
+            scene_futures = []
+            if narration:
+                scene_futures.append(("audio", executor.submit(
+                    _run_rate_limited, audio_client.generate_audio_for_video,
+                    narration, output_dir, f"scene_{scene_num}.mp3")))
+            if image_prompt:
+                scene_futures.append(("image", executor.submit(
+                    _run_rate_limited, image_client.generate_image_for_video,
+                    image_prompt, output_dir, f"scene_{scene_num}")))
+
+            futures.extend((scene_num, kind, future) for kind, future in scene_futures)
+            if on_scene_ready and scene_futures:
+                _call_when_done([future for _, future in scene_futures],
+                                lambda written, scene_num=scene_num: on_scene_ready(scene_num, written))
+
+    processed: set[int] = set()
+    for scene_num, kind, future in futures:
+        try:
+            future.result()
+            processed.add(scene_num)
+        except Exception as e:
+            logger.error(f"{kind.capitalize()} generation failed for scene {scene_num}: {e}")
+
+    return sorted(processed)
+
 # --- API Endpoint for Video Generation ---
 @app.route('/generate-video', methods=['POST'])
 def generate_video_endpoint():
+    scene_encoder = None
     try:
         data = request.get_json()
         prompt = data.get("prompt")
@@ -70,63 +183,46 @@ def generate_video_endpoint():
 
         logger.info(f"Received request: Prompt='{prompt}', Scenes={scenes}, Style='{style}', Format='{format_type}'")
 
-        story = {}
+        # Imported on first use so the server starts without loading the video pipeline
+        from video_synchronization import SceneEncoder
+
         if format_type.lower() == "legacy":
             story = story_generator_client.generate_story_legacy_format(prompt, scenes)
+            story_title = story.get("title", "Untitled Story")
+            dir_name, output_dir = create_output_dir(story_title)
+            scene_encoder = SceneEncoder(output_dir, max_workers=ENCODE_WORKERS)
+            scenes_data_list = [v for k, v in story.get("response", {}).items() if k.startswith("scene")]
+            processed_scene_nums = generate_scene_assets(
+                scenes_data_list, format_type, output_dir, on_scene_ready=scene_encoder.submit)
         else:
-            story_response_obj = story_generator_client.generate_story(prompt, scenes, style)
-            story = story_response_obj.dict()
-
-        story_title = story.get("title", "Untitled Story")
-        safe_title = "".join(c for c in story_title if c.isalnum()).strip() or "Untitled_Story"
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        dir_name = f"{safe_title}_{timestamp}"
-        output_dir = os.path.join(GENERATED_VIDEOS_DIR, dir_name)
-        os.makedirs(output_dir, exist_ok=True)
-
-        with open(os.path.join(output_dir, "story_data.json"), "w") as f:
-            json.dump(story, f, indent=2)
-
-        scenes_data_list = (
-            [v for k, v in story.get("response", {}).items() if k.startswith("scene")]
-            if format_type.lower() == "legacy"
-            else story.get("scenes", [])
-        )
+            # Stream the story so each scene's audio and image start as soon as the
+            # model has written that scene, rather than after the whole story.
+            # The title precedes the scenes, so it is known once the first scene arrives.
+            story_stream = story_generator_client.stream_story(prompt, scenes, style)
+            scene_iter = iter(story_stream)
+            first_scene = next(scene_iter, None)
+            story_title = story_stream.title or "Untitled Story"
+            dir_name, output_dir = create_output_dir(story_title)
+            scene_encoder = SceneEncoder(output_dir, max_workers=ENCODE_WORKERS)
+            scenes_data = scene_iter if first_scene is None else chain([first_scene], scene_iter)
+            # Each scene's video is encoded as soon as its audio and image are ready
+            processed_scene_nums = generate_scene_assets(
+                scenes_data, format_type, output_dir, on_scene_ready=scene_encoder.submit)
+            # Use the validated dict directly rather than re-serializing the StoryResponse
+            story = story_stream.story_dict
+            # The directory is named before the stream finishes, but the full story
+            # always carries the title, even if the model wrote it after the scenes
+            story_title = story.get("title") or story_title
 
-        processed_scene_nums = []
-        for i, scene in enumerate(scenes_data_list):
-            scene_num = i + 1
-            narration = None
-            image_prompt = None
-
-            if format_type.lower() == "legacy":
-                narration = scene.get('narration')
-                image_prompt = scene.get('image_prompt')
-            elif 'media' in scene:
-                narration = scene['media'].get('audio_narration')
-                image_prompt = scene['media'].get('image_prompt')
-
-            if narration:
-                try:
-                    audio_client.generate_audio_for_video(narration, output_dir, f"scene_{scene_num}.mp3")
-                    processed_scene_nums.append(scene_num)
-                except Exception as e:
-                    logger.error(f"Audio generation failed for scene {scene_num}: {e}")
-
-            if image_prompt:
-                try:
-                    image_client.generate_image_for_video(image_prompt, output_dir, f"scene_{scene_num}")
-                    if scene_num not in processed_scene_nums:
-                        processed_scene_nums.append(scene_num)
-                except Exception as e:
-                    logger.error(f"Image generation failed for scene {scene_num}: {e}")
+        Path(output_dir, "story_data.json").write_bytes(orjson.dumps(story, option=orjson.OPT_INDENT_2))
 
         if not processed_scene_nums:
             return jsonify({"error": "No assets generated."}), 500
 
         video_output_file_name = f"{dir_name}.mp4"
-        generate_video(output_dir, processed_scene_nums, video_output_file_name)
-        final_video_path = os.path.join(output_dir, video_output_file_name)
+        final_video_path = scene_encoder.finish(video_output_file_name)
+        if final_video_path is None:
+            return jsonify({"error": "Video generation failed."}), 500
 
         video_download_url = f"/download-video/{dir_name}/{video_output_file_name}"
         video_stream_url = f"/stream-video/{dir_name}/{video_output_file_name}"
@@ -143,12 +239,19 @@ def generate_video_endpoint():
         logger.error(f"Error during video generation: {str(e)}", exc_info=True)
         return jsonify({"error": f"An internal error occurred: {str(e)}"}), 500
 
+    finally:
+        # Stops any encodes still running after a failure and removes the per-scene MP4s
+        if scene_encoder is not None:
+            scene_encoder.close()
+
 # --- Download and Stream Routes ---
 @app.route("/download-video/<project>/<filename>", methods=["GET"])
 def download_video(project, filename):
     try:
         video_dir = os.path.join(GENERATED_VIDEOS_DIR, project)
-        return send_from_directory(video_dir, filename, as_attachment=True)
+        # Returns a file-backed response, so under gunicorn the body is handed to
+        # wsgi.file_wrapper and copied to the socket by sendfile(2).
+        return send_from_directory(video_dir, filename, as_attachment=True, conditional=True)
     except Exception as e:
         logger.error(f"Error downloading video: {e}")
         return "Video not found", 404
@@ -157,7 +260,15 @@ def download_video(project, filename):
 def stream_video(project, filename):
     try:
         video_path = os.path.join(GENERATED_VIDEOS_DIR, project, filename)
-        return send_file(video_path, mimetype="video/mp4")
+        # Conditional responses let Werkzeug answer Range requests (seeking) with
+        # just the requested bytes and repeat loads with 304 Not Modified.
+        return send_file(
+            video_path,
+            mimetype="video/mp4",
+            conditional=True,
+            etag=True,
+            last_modified=os.path.getmtime(video_path)
+        )
     except Exception as e:
         logger.error(f"Error streaming video: {e}")
         return "Video not found", 404
@@ -167,5 +278,6 @@ def open_browser():
     webbrowser.open_new_tab("http://127.0.0.1:5000/")
 
 if __name__ == "__main__":
+    # Local development only; production runs wsgi:app under gunicorn (see gunicorn.conf.py)
     Timer(1.5, open_browser).start()
     app.run(debug=True, use_reloader=False)
@@ -0,0 +1,153 @@
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+from threading import Lock
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed cache shared by the story, audio and image generators so that
+# re-running an identical request skips the corresponding OpenAI calls.
+# Setting STORY2SCENE_CACHE_DIR to an empty string disables the cache.
+CACHE_DIR = os.getenv("STORY2SCENE_CACHE_DIR", ".story2scene_cache")
+
+# Once the cache grows past this size, the least recently used entries are deleted
+CACHE_MAX_BYTES = int(os.getenv("STORY2SCENE_CACHE_MAX_MB", "1024")) * 1024 * 1024
+_evict_lock = Lock()
+# Running size of the cache in bytes, None until the first store scans the directory
+_cache_size: Optional[int] = None
+
+def cache_key(*parts) -> str:
+    """Returns a SHA-256 hex digest identifying the given request parameters."""
+    return hashlib.sha256("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+def _entry_path(namespace: str, key: str, ext: str) -> str:
+    return os.path.join(CACHE_DIR, namespace, f"{key}{ext}")
+
+def _atomic_write(path: str, data: bytes):
+    """Writes via a temp file and rename so concurrent readers never see partial entries."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def _touch(path: str):
+    """Marks an entry as recently used, so eviction removes it last."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def _evict() -> int:
+    """
+    Deletes the least recently used entries until the cache fits in CACHE_MAX_BYTES.
+
+    Returns:
+        Total size of the cache in bytes after eviction.
+    """
+    entries = []
+    total = 0
+    for namespace in os.scandir(CACHE_DIR):
+        if not namespace.is_dir():
+            continue
+        for entry in os.scandir(namespace.path):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+    if total <= CACHE_MAX_BYTES:
+        return total
+
+    entries.sort()
+    for _, size, path in entries:
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        if total <= CACHE_MAX_BYTES:
+            break
+    return total
+
+def _record_store(size: int):
+    """
+    Adds a stored entry to the running cache size. The cache directory is only
+    scanned on the first store and when the running total crosses CACHE_MAX_BYTES.
+    Overwritten entries are counted twice, which at worst triggers an early rescan.
+    """
+    global _cache_size
+    with _evict_lock:
+        if _cache_size is None or _cache_size + size > CACHE_MAX_BYTES:
+            _cache_size = _evict()
+        else:
+            _cache_size += size
+
+def load_file(namespace: str, key: str, ext: str, dest_path: str) -> bool:
+    """
+    Copies a cached file to dest_path.
+
+    Returns:
+        True on a cache hit, False otherwise.
+    """
+    if not CACHE_DIR:
+        return False
+    path = _entry_path(namespace, key, ext)
+    try:
+        shutil.copyfile(path, dest_path)
+        _touch(path)
+        logger.info(f"Cache hit for {namespace} entry {key[:12]}")
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        logger.warning(f"Failed to read {namespace} cache entry {key[:12]}: {e}")
+        return False
+
+def store_file(namespace: str, key: str, ext: str, src_path: str):
+    """Stores a copy of src_path in the cache. Failures are logged, never raised."""
+    if not CACHE_DIR:
+        return
+    try:
+        with open(src_path, "rb") as f:
+            data = f.read()
+        _atomic_write(_entry_path(namespace, key, ext), data)
+        _record_store(len(data))
+    except OSError as e:
+        logger.warning(f"Failed to cache {namespace} entry {key[:12]}: {e}")
+
+def load_text(namespace: str, key: str) -> Optional[str]:
+    """Returns the cached text for key, or None on a cache miss."""
+    if not CACHE_DIR:
+        return None
+    path = _entry_path(namespace, key, ".json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        _touch(path)
+        logger.info(f"Cache hit for {namespace} entry {key[:12]}")
+        return text
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logger.warning(f"Failed to read {namespace} cache entry {key[:12]}: {e}")
+        return None
+
+def store_text(namespace: str, key: str, text: str):
+    """Stores text in the cache. Failures are logged, never raised."""
+    if not CACHE_DIR:
+        return
+    try:
+        data = text.encode("utf-8")
+        _atomic_write(_entry_path(namespace, key, ".json"), data)
+        _record_store(len(data))
+    except OSError as e:
+        logger.warning(f"Failed to cache {namespace} entry {key[:12]}: {e}")
@@ -1,21 +1,35 @@
 from openai import OpenAI
-from dotenv import load_dotenv
+from typing import Optional
 import os
+import shutil
 import logging
 
-load_dotenv()
+import asset_cache
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__) # Logger for audio_generation.py
 
+# Pre-encoded 5-second silent MP3 used when TTS fails, so the fallback is a file copy
+SILENT_AUDIO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "silence_5s.mp3")
+
 class AudioModel:
-    def __init__(self):
-        logger.info("Initializing OpenAI audio client")
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable not set for AudioModel.")
-        self.client = OpenAI(api_key=api_key)
-        logger.info("Initialized OpenAI audio client successfully")
+    TTS_MODEL = "tts-1-hd" # High-quality TTS model
+    VOICE = "shimmer"      # Or 'alloy', 'echo', 'fable', 'onyx', 'nova'
+    SPEED = 0.90           # Adjust speech speed
+
+    def __init__(self, client: Optional[OpenAI] = None):
+        """
+        Args:
+            client (OpenAI, optional): A shared OpenAI client. If omitted, a new one
+                is created from the OPENAI_API_KEY environment variable.
+        """
+        if client is None:
+            logger.info("Initializing OpenAI audio client")
+            api_key = os.getenv("OPENAI_API_KEY")
+            if not api_key:
+                raise ValueError("OPENAI_API_KEY environment variable not set for AudioModel.")
+            client = OpenAI(api_key=api_key)
+            logger.info("Initialized OpenAI audio client successfully")
+        self.client = client
 
     def generate_audio_for_video(self, prompt: str, dir_name: str, audio_name: str) -> str:
         """
@@ -34,37 +48,32 @@ class AudioModel:
         # Ensure the directory exists
         os.makedirs(dir_name, exist_ok=True)
 
+        cache_key = asset_cache.cache_key(prompt, self.VOICE, self.SPEED, self.TTS_MODEL)
+        if asset_cache.load_file("audio", cache_key, ".mp3", full_audio_path):
+            return full_audio_path
+
         try:
             logger.info(f"Generating audio for: '{prompt[:50]}...'") # Log first 50 chars
-            response = self.client.audio.speech.create(
-                model="tts-1-hd", # High-quality TTS model
-                voice="shimmer",  # Or 'alloy', 'echo', 'fable', 'onyx', 'nova'
+            # Stream the MP3 to disk as it is synthesized instead of waiting for
+            # the whole body to be buffered in memory first.
+            with self.client.audio.speech.with_streaming_response.create(
+                model=self.TTS_MODEL,
+                voice=self.VOICE,
                 input=prompt,
-                speed=0.90        # Adjust speech speed
-            )
-            logger.info("Audio generation response received.")
-
-            with open(full_audio_path, "wb") as audio_file:
-                for chunk in response.iter_bytes():
-                    audio_file.write(chunk)
+                speed=self.SPEED
+            ) as response:
+                logger.info("Audio generation response received.")
+                with open(full_audio_path, "wb") as audio_file:
+                    for chunk in response.iter_bytes():
+                        audio_file.write(chunk)
             logger.info(f"Saved audio to {full_audio_path}")
+            asset_cache.store_file("audio", cache_key, ".mp3", full_audio_path)
             return full_audio_path
         except Exception as e:
             logger.error(f"Error generating or saving audio to {full_audio_path}: {str(e)}", exc_info=True)
             # Create a dummy silent audio file to prevent video generation from crashing
             try:
-                # Using pydub (requires ffmpeg)
-                # from pydub import AudioSegment
-                # silent_audio = AudioSegment.silent(duration=5000) # 5 seconds of silence
-                # silent_audio.export(full_audio_path, format="mp3")
-                
-                # A simpler approach using moviepy's AudioFileClip for consistency and minimal new deps
-                # This requires moviepy to be installed and ffmpeg accessible.
-                # A 5-second silence clip
-                from moviepy.editor import AudioFileClip
-                dummy_audio = AudioFileClip("dummy_silent.mp3").set_duration(5) # Create a dummy silent clip
-                dummy_audio.write_audiofile(full_audio_path)
-                dummy_audio.close()
+                shutil.copyfile(SILENT_AUDIO_PATH, full_audio_path)
                 logger.warning(f"Created a dummy silent audio file at {full_audio_path} due to error.")
                 return full_audio_path
             except Exception as dummy_e:
@@ -73,17 +82,9 @@ class AudioModel:
 
 if __name__ == "__main__":
     # Example usage when run directly (for testing)
-    # This block will now create a dummy_silent.mp3 in the current directory first if not present
-    # This dummy file is just for moviepy's internal use for a fallback if the real one fails.
-    # It's better to ensure a proper audio generation or a silence function.
-    # For a quick test, you might want a short valid audio file.
-    
-    # Create a dummy silent audio file if it doesn't exist for the MoviePy fallback in `generate_audio_for_video`
-    if not os.path.exists("dummy_silent.mp3"):
-        from pydub import AudioSegment
-        silent_audio = AudioSegment.silent(duration=5000) # 5 seconds of silence
-        silent_audio.export("dummy_silent.mp3", format="mp3")
-        logger.info("Created dummy_silent.mp3 for fallback.")
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
 
     audio_client = AudioModel()
     test_dir = "test_audio_output"
@@ -0,0 +1,11 @@
+# Gunicorn settings, picked up automatically by `gunicorn wsgi:app`.
+# Each video request spends most of its time waiting on OpenAI and ffmpeg, so
+# threaded workers let many requests overlap inside each process.
+bind = "0.0.0.0:5000"
+worker_class = "gthread"
+workers = 2
+threads = 16
+# Generating a full video can take several minutes
+timeout = 300
+# Let the kernel copy downloaded video files straight to the socket
+sendfile = True
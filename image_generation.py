@@ -2,23 +2,37 @@ from openai import OpenAI
 from PIL import Image
 from io import BytesIO
 import os
-from dotenv import load_dotenv
-import requests
+import base64
+from typing import Optional, Tuple
 import logging
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__) # Logger for image_generation.py
+import asset_cache
 
-load_dotenv()
+logger = logging.getLogger(__name__) # Logger for image_generation.py
 
 class ImageModel:
-    def __init__(self):
-        logger.info("Initializing OpenAI image client")
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable not set for ImageModel.")
-        self.client = OpenAI(api_key=api_key)
-        logger.info("Initialized OpenAI image client successfully")
+    IMAGE_MODEL = "dall-e-3"
+    SIZE = "1024x1024"     # DALL-E 3 supports 1024x1024, 1024x1792, 1792x1024
+    QUALITY = "standard"   # or "hd"
+
+    def __init__(self, client: Optional[OpenAI] = None, max_size: Tuple[int, int] = (1024, 1024)):
+        """
+        Args:
+            client (OpenAI, optional): A shared OpenAI client. If omitted, a new one
+                is created from the OPENAI_API_KEY environment variable.
+            max_size (tuple, optional): Bounding box (width, height) saved images are
+                downscaled to fit, e.g. the final video resolution. Defaults to the
+                DALL-E output size, which leaves images untouched.
+        """
+        self.max_size = max_size
+        if client is None:
+            logger.info("Initializing OpenAI image client")
+            api_key = os.getenv("OPENAI_API_KEY")
+            if not api_key:
+                raise ValueError("OPENAI_API_KEY environment variable not set for ImageModel.")
+            client = OpenAI(api_key=api_key)
+            logger.info("Initialized OpenAI image client successfully")
+        self.client = client
 
     def generate_image_for_video(self, prompt: str, dir_name: str, img_name_base: str) -> str:
         """
@@ -38,31 +52,37 @@ class ImageModel:
         # Ensure the directory exists
         os.makedirs(dir_name, exist_ok=True)
 
+        cache_key = asset_cache.cache_key(prompt, self.SIZE, self.QUALITY, self.IMAGE_MODEL, self.max_size)
+        if asset_cache.load_file("image", cache_key, ".jpg", full_image_path):
+            return full_image_path
+
         try:
             logger.info(f"Generating image for prompt: '{prompt[:50]}...'") # Log first 50 chars
             response = self.client.images.generate(
-                model="dall-e-3",
+                model=self.IMAGE_MODEL,
                 prompt=prompt,
-                size="1024x1024", # DALL-E 3 supports 1024x1024, 1024x1792, 1792x1024
-                quality="standard", # or "hd"
+                size=self.SIZE,
+                quality=self.QUALITY,
                 n=1,
+                # Return the image inline so it arrives over the already-pooled API
+                # connection instead of needing a second download from the CDN.
+                response_format="b64_json",
             )
             logger.info("Image generation response received.")
-            image_url = response.data[0].url
+            image_b64 = response.data[0].b64_json
             
-            if not image_url:
-                raise ValueError("No image URL returned by DALL-E API.")
-
-            image_response = requests.get(image_url)
-            image_response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
+            if not image_b64:
+                raise ValueError("No image data returned by DALL-E API.")
 
-            image = Image.open(BytesIO(image_response.content))
-            image.save(full_image_path)
+            # The video pipeline expects JPGs, so the PNG is decoded and encoded
+            # once, skipping the costly optimize pass. Storing it at no more than
+            # the target resolution keeps files small and spares the video stage
+            # from scaling it down again.
+            image = Image.open(BytesIO(base64.b64decode(image_b64))).convert("RGB")
+            image.thumbnail(self.max_size, Image.LANCZOS)
+            image.save(full_image_path, "JPEG", quality=85, optimize=False)
             logger.info(f"Saved image to {full_image_path}")
-            return full_image_path
-        except requests.exceptions.RequestException as req_e:
-            logger.error(f"Network or HTTP error fetching image from {image_url}: {req_e}", exc_info=True)
-            self._create_dummy_image(full_image_path)
+            asset_cache.store_file("image", cache_key, ".jpg", full_image_path)
             return full_image_path
         except Exception as e:
             logger.error(f"Error generating or saving image to {full_image_path}: {str(e)}", exc_info=True)
@@ -83,6 +103,10 @@ class ImageModel:
 
 if __name__ == "__main__":
     # Example usage when run directly (for testing)
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
     image_client = ImageModel()
     test_dir = "test_image_output"
     os.makedirs(test_dir, exist_ok=True)
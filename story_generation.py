@@ -1,20 +1,18 @@
 import os
-import json
+import orjson
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator
 from pydantic import BaseModel, Field
 from datetime import datetime
-from dotenv import load_dotenv
 from openai import OpenAI
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+import asset_cache
+
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+# Bump whenever the system prompt, user message or function schema changes so
+# cached stories generated with the old instructions are no longer reused.
+SYSTEM_PROMPT_VERSION = 3
 
 class MediaElement(BaseModel):
     """Class for defining multimedia elements of a scene"""
@@ -59,25 +57,159 @@ class StoryResponse(BaseModel):
         description="Additional metadata about the generated story"
     )
 
+class _SceneStreamParser:
+    """
+    Incrementally scans the streamed generate_story arguments and returns each scene
+    object as soon as its closing brace arrives, along with the story title.
+    """
+    
+    def __init__(self):
+        self.text = ""
+        self.title: Optional[str] = None
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._expect_value = False
+        self._last_key: Optional[str] = None
+        self._in_scenes = False
+        self._scene_start = 0
+        
+    def feed(self, fragment: str) -> List[Dict[str, Any]]:
+        """Append a fragment of the JSON arguments and return any scenes it completed"""
+        self.text += fragment
+        text = self.text
+        scenes = []
+        for i in range(self._pos, len(text)):
+            char = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._on_top_level_string(text[self._string_start:i + 1])
+            elif char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char == ":" and self._depth == 1:
+                self._expect_value = True
+            elif char == "," and self._depth == 1:
+                self._expect_value = False
+            elif char in "{[":
+                self._depth += 1
+                if char == "[" and self._depth == 2 and self._expect_value and self._last_key == "scenes":
+                    self._in_scenes = True
+                elif char == "{" and self._depth == 3 and self._in_scenes:
+                    self._scene_start = i
+            elif char in "}]":
+                if char == "}" and self._depth == 3 and self._in_scenes:
+                    scenes.append(orjson.loads(text[self._scene_start:i + 1]))
+                elif char == "]" and self._depth == 2:
+                    self._in_scenes = False
+                self._depth -= 1
+        self._pos = len(text)
+        return scenes
+        
+    def _on_top_level_string(self, token: str):
+        """Track top-level keys, and capture the title value once it is complete"""
+        if not self._expect_value:
+            self._last_key = orjson.loads(token)
+        elif self._last_key == "title":
+            self.title = orjson.loads(token)
+
+class StoryStream:
+    """
+    Iterates over the scenes of a story while it is being generated, so callers can
+    start producing a scene's assets before the model has written the rest of the story.
+    Each scene is validated against the Scene model before it is yielded, so a
+    malformed scene fails before any assets are requested for it.
+    After iteration completes, `story` holds the validated StoryResponse and
+    `story_dict` the same story as a plain dictionary, with the model's defaults.
+    """
+    
+    def __init__(self, generator: "StoryGenerator", prompt: str, num_scenes: int, style: Optional[str]):
+        self._generator = generator
+        self.prompt = prompt
+        self.num_scenes = num_scenes
+        self.style = style
+        self.title: Optional[str] = None
+        self.story: Optional[StoryResponse] = None
+        self.story_dict: Optional[Dict[str, Any]] = None
+
+    @staticmethod
+    def _validate_scene(scene: Dict[str, Any]) -> Dict[str, Any]:
+        """Validates a scene and returns it as a dictionary with the model's defaults filled in"""
+        return Scene(**scene).model_dump()
+        
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        generator = self._generator
+        try:
+            logger.info(f"Generating story for prompt: {self.prompt}")
+            
+            cache_key = asset_cache.cache_key(self.prompt, self.num_scenes, self.style, generator.model_name, SYSTEM_PROMPT_VERSION)
+            arguments = asset_cache.load_text("story", cache_key)
+            from_cache = arguments is not None
+            # Scenes are kept as validated dicts so story_dict can be assembled
+            # without dumping the whole StoryResponse again
+            scenes = []
+            if from_cache:
+                cached = orjson.loads(arguments)
+                self.title = cached.get("title")
+                for scene in cached.get("scenes", []):
+                    scenes.append(self._validate_scene(scene))
+                    yield scenes[-1]
+            else:
+                parser = _SceneStreamParser()
+                for fragment in generator._stream_story_arguments(self.prompt, self.num_scenes, self.style):
+                    for scene in parser.feed(fragment):
+                        self.title = parser.title
+                        scenes.append(self._validate_scene(scene))
+                        yield scenes[-1]
+                # The model may write the title after the scenes
+                self.title = parser.title
+                arguments = parser.text
+                
+            self.story = generator._parse_story(arguments, self.prompt)
+            self.story_dict = {**self.story.model_dump(exclude={"scenes"}), "scenes": scenes}
+            
+            # Only cache responses that parsed and validated cleanly
+            if not from_cache:
+                asset_cache.store_text("story", cache_key, arguments)
+                
+        except Exception as e:
+            logger.error(f"Error generating story: {str(e)}", exc_info=True)
+            raise
+
 class StoryGenerator:
     """Generates structured stories for automatic video creation"""
     
-    def __init__(self, api_key: Optional[str] = None):
-        """Initialize the StoryGenerator with OpenAI API key"""
-        self._initialize_llm(api_key)
+    def __init__(self, api_key: Optional[str] = None, client: Optional[OpenAI] = None):
+        """Initialize the StoryGenerator with OpenAI API key or a shared OpenAI client"""
+        self._initialize_llm(api_key, client)
+        # Built once and reused verbatim so every request shares the same prompt
+        # prefix, which lets OpenAI's automatic prompt caching kick in.
+        self._system_prompt = self._create_system_prompt()
+        self._tools = [{"type": "function", "function": self._create_function_schema()}]
+        self._tool_choice = {"type": "function", "function": {"name": "generate_story"}}
         
-    def _initialize_llm(self, api_key: Optional[str] = None):
+    def _initialize_llm(self, api_key: Optional[str] = None, client: Optional[OpenAI] = None):
         """Initialize the OpenAI client"""
         try:
-            # Use provided API key or get from environment
-            if not api_key:
-                api_key = os.getenv("OPENAI_API_KEY")
-                
-            if not api_key:
-                raise ValueError("No OpenAI API key provided. Set OPENAI_API_KEY environment variable or pass api_key to constructor.")
-                
-            # Initialize OpenAI client
-            self.client = OpenAI(api_key=api_key)
+            if client is None:
+                # Use provided API key or get from environment
+                if not api_key:
+                    api_key = os.getenv("OPENAI_API_KEY")
+                    
+                if not api_key:
+                    raise ValueError("No OpenAI API key provided. Set OPENAI_API_KEY environment variable or pass api_key to constructor.")
+                    
+                # Initialize OpenAI client
+                client = OpenAI(api_key=api_key)
+            self.client = client
             self.model_name = os.getenv("OPENAI_MODEL", "gpt-4o") # Changed default to gpt-4o for potentially better function calling
             logger.info(f"LLM initialized successfully with model: {self.model_name}")
         except Exception as e:
@@ -107,6 +239,48 @@ Important requirements:
 - The story should have a clear beginning, middle, and end.
 - The whole story when read through all scenes should feel cohesive and complete.
 - Ensure the image prompts for consecutive scenes depict a logical progression of the story's visuals.
+- Make sure each scene flows naturally from the previous one, with audio narration that continues the story and image prompts that are extremely detailed for high-quality generation.
+
+Writing the audio narration:
+- Write for the ear, not the page. Prefer short and medium-length sentences with a clear rhythm, and avoid parentheses, lists, abbreviations, or symbols that a text-to-speech voice would read awkwardly.
+- Keep each scene's narration to roughly two to five sentences so that it comfortably fits the suggested duration when read at a calm storytelling pace.
+- Open the first scene by establishing the setting and the main character, and close the final scene with a sense of resolution.
+- Do not describe camera directions or refer to "this scene" or "the image"; the narration should read as a continuous story.
+- Keep names, places, and key objects consistent across all scenes.
+
+Writing the image prompts:
+- Each image prompt must stand on its own, because the image model does not see the other scenes. Restate the appearance of recurring characters (age, build, hair, clothing, distinctive features) and key locations in every prompt where they appear.
+- Describe the subject, the action, the setting, the time of day, the lighting, the color palette, the camera angle and framing, and the overall mood.
+- Name a consistent artistic style for the whole story (for example cinematic digital painting, watercolor illustration, or photorealistic film still) and repeat it in every prompt so the scenes look like they belong together.
+- Compose each image as a single clear moment; avoid split panels, collages, captions, speech bubbles, or any written text in the image.
+- Keep the content suitable for a general audience.
+
+Keeping the story coherent:
+- Before writing the scenes, decide on the main character, their goal, the obstacle they face, and how the story ends, then make every scene serve that arc.
+- Give each scene one clear purpose: introducing the world, raising the stakes, a moment of discovery, a setback, the climax, or the resolution.
+- Let time, weather, and lighting change gradually between scenes unless the story calls for a deliberate jump, and mention such jumps in the narration.
+- Carry visual motifs, such as a recurring object, color, or landmark, through several scenes so the viewer can follow the story from the images alone.
+- The scene title should be a few evocative words, and the scene description should summarize the action in one or two sentences for the video editor.
+- The story title should be short, memorable, and suitable as a file name, and the theme should be a single phrase.
+
+Choosing the other scene elements:
+- Background music should be a short description of mood and instrumentation, such as "gentle piano and strings" or "tense low percussion".
+- Suggested durations should usually fall between 5 and 15 seconds and should reflect the length of the narration.
+- Use "cut" for direct continuations, "fade" for the passing of time or the ending, and "dissolve" for changes of place or dream-like moments.
+
+Applying the requested style:
+- Dramatic: high emotional stakes, vivid contrasts in lighting, and a clear turning point.
+- Comedic: light-hearted tone, playful situations, and warm, bright visuals.
+- Mysterious or suspenseful: withheld information, shadows and muted colors, and a reveal near the end.
+- Whimsical or fairy tale: gentle wonder, soft saturated colors, and storybook imagery.
+- Inspirational: a character who overcomes an obstacle, with warm light that brightens as the story progresses.
+- Educational: accurate information woven into the narrative, with clear and uncluttered visuals.
+If no style is given, choose the style that best suits the prompt.
+
+Output format:
+- Always respond by calling the generate_story function. Do not reply with plain text.
+- Return exactly the number of scenes requested unless the prompt makes that impossible.
+- Fill in every required field for every scene, using plain text without markdown.
 """
 
     def _create_function_schema(self) -> Dict[str, Any]:
@@ -185,55 +359,101 @@ Important requirements:
         Returns:
             StoryResponse object containing the structured story
         """
-        try:
-            logger.info(f"Generating story for prompt: {prompt}")
+        story_stream = self.stream_story(prompt, num_scenes, style)
+        for _ in story_stream:
+            pass
+        return story_stream.story
+
+    def generate_story_dict(self, prompt: str, num_scenes: int = 5, style: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Generate a structured story and return it as a validated plain dictionary
+        
+        The scenes are the dictionaries validated while streaming, so the whole
+        StoryResponse is not converted back into a dictionary.
+        
+        Args:
+            prompt: The user's story prompt or request
+            num_scenes: Suggested number of scenes (default: 5)
+            style: Optional style guidance (e.g., "dramatic", "comedic")
             
-            # Prepare the messages
-            user_prompt = f"Create a story with approximately {num_scenes} scenes based on the following prompt: {prompt}"
-            if style:
-                user_prompt += f"\nThe story should be in a {style} style."
-                
-            user_prompt += "\n\nMake sure each scene flows naturally from the previous one, with audio narration that continues the story and image prompts that are extremely detailed for high-quality generation."
-                
-            messages = [
-                {"role": "system", "content": self._create_system_prompt()},
-                {"role": "user", "content": user_prompt}
-            ]
+        Returns:
+            Dictionary with the same structure as StoryResponse
+        """
+        story_stream = self.stream_story(prompt, num_scenes, style)
+        for _ in story_stream:
+            pass
+        return story_stream.story_dict
+
+    def stream_story(self, prompt: str, num_scenes: int = 5, style: Optional[str] = None) -> "StoryStream":
+        """
+        Generate a structured story, yielding each scene as soon as the model has finished writing it
+        
+        Args:
+            prompt: The user's story prompt or request
+            num_scenes: Suggested number of scenes (default: 5)
+            style: Optional style guidance (e.g., "dramatic", "comedic")
             
-            # Call the OpenAI API with function calling
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                tools=[{"type": "function", "function": self._create_function_schema()}],
-                tool_choice={"type": "function", "function": {"name": "generate_story"}},
-                temperature=0.7,
-                max_tokens=3000
-            )
+        Returns:
+            StoryStream that yields scene dictionaries; its `story` and `story_dict`
+            attributes hold the validated story once iteration has finished
+        """
+        return StoryStream(self, prompt, num_scenes, style)
+
+    def _parse_story(self, arguments: str, prompt: str) -> StoryResponse:
+        """Parse the function call arguments, add metadata and validate them as a StoryResponse"""
+        result = orjson.loads(arguments)
+        
+        # Add metadata
+        if "metadata" not in result:
+            result["metadata"] = {}
             
-            # Extract and parse the function call
-            tool_call = response.choices[0].message.tool_calls[0]
-            if tool_call:
-                result = json.loads(tool_call.function.arguments)
-                
-                # Add metadata
-                if "metadata" not in result:
-                    result["metadata"] = {}
-                    
-                result["metadata"]["generation_timestamp"] = datetime.now().isoformat()
-                result["metadata"]["prompt"] = prompt
-                result["metadata"]["model"] = self.model_name
-                
-                # Convert to Pydantic model for validation
-                story_response = StoryResponse(**result)
-                logger.info(f"Successfully generated story '{story_response.title}' with {len(story_response.scenes)} scenes")
-                
-                return story_response
-            else:
-                raise ValueError("No function call in the response from OpenAI.")
+        result["metadata"]["generation_timestamp"] = datetime.now().isoformat()
+        result["metadata"]["prompt"] = prompt
+        result["metadata"]["model"] = self.model_name
+        
+        # Convert to Pydantic model for validation
+        story_response = StoryResponse(**result)
+        logger.info(f"Successfully generated story '{story_response.title}' with {len(story_response.scenes)} scenes")
+        return story_response
+
+    def _stream_story_arguments(self, prompt: str, num_scenes: int, style: Optional[str]) -> Iterator[str]:
+        """Call the OpenAI API with streaming and yield the generate_story function call arguments as they arrive"""
+        # Prepare the messages. Everything that varies between requests goes at the
+        # end so the system prompt stays a byte-identical, cacheable prefix.
+        user_prompt = f"Create a story with exactly {num_scenes} scenes."
+        if style:
+            user_prompt += f"\nThe story should be in a {style} style."
+            
+        user_prompt += f"\n\nStory prompt: {prompt}"
+            
+        messages = [
+            {"role": "system", "content": self._system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        
+        # Call the OpenAI API with function calling
+        response = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            tools=self._tools,
+            tool_choice=self._tool_choice,
+            temperature=0.7,
+            max_tokens=3000,
+            stream=True
+        )
+        
+        # Extract the function call fragments
+        received_arguments = False
+        for chunk in response:
+            if not chunk.choices:
+                continue
+            tool_calls = chunk.choices[0].delta.tool_calls
+            if tool_calls and tool_calls[0].function and tool_calls[0].function.arguments:
+                received_arguments = True
+                yield tool_calls[0].function.arguments
                 
-        except Exception as e:
-            logger.error(f"Error generating story: {str(e)}", exc_info=True)
-            raise
+        if not received_arguments:
+            raise ValueError("No function call in the response from OpenAI.")
 
     def generate_story_legacy_format(self, message: str, num_scenes: int = 5) -> Dict[str, Any]:
         """
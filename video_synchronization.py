@@ -1,125 +1,290 @@
 import os
 import logging
-# from moviepy.editor import ProgressBar
-from moviepy.editor import (
-    ImageClip, AudioFileClip, concatenate_videoclips,
-    CompositeVideoClip, ColorClip
-)
+import subprocess
+from functools import lru_cache
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, Future
+import cv2
+import numpy as np
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
 
-def generate_video(project_dir: str, scene_numbers: list[int], output_filename: str = "final_video.mp4") -> str | None:
+# PyTurboJPEG is optional; without it (or without the libturbojpeg library)
+# images are decoded with OpenCV instead.
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    _turbo_jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _turbo_jpeg = None
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+FFPROBE_BINARY = os.getenv("FFPROBE_BINARY", "ffprobe")
+
+VIDEO_SIZE = (1280, 720)
+FPS = 30
+
+def _probe_duration(path: str) -> float:
+    """Reads a media file's duration in seconds with ffprobe, without opening a decoder."""
+    output = subprocess.check_output(
+        [FFPROBE_BINARY, "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path]
+    )
+    return float(output)
+
+@lru_cache(maxsize=None)
+def _black_frame(width: int, height: int) -> np.ndarray:
+    """Shared read-only black frame used for scenes without an image."""
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    frame.flags.writeable = False
+    return frame
+
+def _read_image(image_path: str):
+    """Decodes an image to a BGR array, or returns None if it cannot be read."""
+    if _turbo_jpeg is not None:
+        try:
+            with open(image_path, "rb") as f:
+                return _turbo_jpeg.decode(f.read(), pixel_format=TJPF_BGR)
+        except OSError as e:
+            logger.warning(f"libjpeg-turbo could not decode {image_path}, falling back to OpenCV: {e}")
+    return cv2.imread(image_path, cv2.IMREAD_COLOR)
+
+def _scene_video_path(project_dir: str, scene_num: int) -> str:
+    """Path of the temporary per-scene MP4 that is later stream-copied into the final video."""
+    return os.path.join(project_dir, f"scene_{scene_num}.mp4")
+
+def _file_exists(path: str, present: set[str] | None) -> bool:
+    """Checks a project file against a pre-scanned set of file names, or the filesystem if there is none."""
+    if present is None:
+        return os.path.exists(path)
+    return os.path.basename(path) in present
+
+def _letterbox_frame(image_path: str, scene_num: int, video_size: tuple[int, int], present: set[str] | None) -> bytes:
     """
-    Combines generated images and audio into a final video.
-    Assumes image and audio files are named 'scene_X.jpg' and 'scene_X.mp3' in project_dir.
-    
+    Fits a scene's image into video_size with black bars, or returns a black frame if there is none.
+    The visible frame is a static image, so it is letterboxed once here and ffmpeg
+    only has to loop it for the length of the narration.
+
     Returns:
-        Path to the saved final video file, or None if generation fails.
+        The letterboxed frame as raw BGR24 bytes.
     """
-    target_width, target_height = 1280, 720
-    video_size = (target_width, target_height)
-    fps = 30
-    clips = []
+    target_width, target_height = video_size
+    image = None
 
-    for scene_num in scene_numbers:
-        image_path = os.path.join(project_dir, f"scene_{scene_num}.jpg")
-        audio_path = os.path.join(project_dir, f"scene_{scene_num}.mp3")
+    # Load image
+    if _file_exists(image_path, present):
+        image = _read_image(image_path)
+        if image is None:
+            logger.error(f"Failed to load image {image_path}")
+        else:
+            logger.info(f"Loaded image for scene {scene_num}")
 
-        img_clip = None
-        audio_clip = None
-        scene_duration = 5.0  # default duration if no audio
+    if image is None:
+        logger.warning(f"Using black screen for scene {scene_num}")
+        frame = _black_frame(target_width, target_height)
+    else:
+        # Resize image with aspect ratio preserved
+        # Compares aspect ratios by cross-multiplying so the sizes are exact integers:
+        # wider than target fits the width (top/bottom bars), otherwise the height (side bars)
+        img_height, img_width = image.shape[:2]
+        wide = img_width * target_height > img_height * target_width
+        new_w = target_width if wide else img_width * target_height // img_height
+        new_h = img_height * target_width // img_width if wide else target_height
 
-        # Load image
-        if os.path.exists(image_path):
-            try:
-                img_clip = ImageClip(image_path)
-                logger.info(f"Loaded image for scene {scene_num}")
-            except Exception as e:
-                logger.error(f"Failed to load image {image_path}: {e}", exc_info=True)
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        # Pad by copying the resized image into the middle of a zeroed canvas
+        top = (target_height - new_h) // 2
+        left = (target_width - new_w) // 2
+        frame = np.zeros((target_height, target_width, 3), dtype=np.uint8)
+        frame[top:top + new_h, left:left + new_w] = image
 
-        if img_clip is None:
-            logger.warning(f"Using black screen for scene {scene_num}")
-            img_clip = ColorClip(size=video_size, color=(0, 0, 0)).set_duration(scene_duration)
+    return frame.tobytes()
 
-        # Load audio
-        if os.path.exists(audio_path):
-            try:
-                audio_clip = AudioFileClip(audio_path)
-                scene_duration = max(audio_clip.duration, 0.1)
-                logger.info(f"Loaded audio for scene {scene_num}")
-            except Exception as e:
-                logger.error(f"Failed to load audio {audio_path}: {e}", exc_info=True)
-                audio_clip = None
-        else:
-            logger.warning(f"Audio not found for scene {scene_num}")
+def encode_scene(project_dir: str, scene_num: int, video_size: tuple[int, int] = VIDEO_SIZE, fps: int = FPS,
+                 threads: int = 0, present: set[str] | None = None) -> str:
+    """
+    Encodes a single scene from 'scene_X.jpg' and 'scene_X.mp3' to its own MP4 with ffmpeg.
+    A threads value of 0 lets x264 pick its own thread count. `present` is an optional
+    set of the file names in project_dir, so callers can scan the directory once.
 
-        # Resize image with aspect ratio preserved
-        img_aspect = img_clip.w / img_clip.h
-        target_aspect = target_width / target_height
+    Returns:
+        Path to the encoded scene video.
+    """
+    target_width, target_height = video_size
+    image_path = os.path.join(project_dir, f"scene_{scene_num}.jpg")
+    audio_path = os.path.join(project_dir, f"scene_{scene_num}.mp3")
+    scene_path = _scene_video_path(project_dir, scene_num)
 
-        if img_aspect > target_aspect:
-            # Wider than target: fit width, add top/bottom bars
-            new_w = target_width
-            new_h = int(target_width / img_aspect)
-        else:
-            # Taller than target: fit height, add side bars
-            new_h = target_height
-            new_w = int(target_height * img_aspect)
+    has_audio = False
+    scene_duration = 5.0  # default duration if no audio
 
-        img_clip = img_clip.resize(newsize=(new_w, new_h)).set_duration(scene_duration)
-        img_clip = img_clip.set_position("center")
+    # Only the raw bytes are kept past this point; the decoded and resized arrays
+    # are released before the ffmpeg encode starts.
+    frame_bytes = _letterbox_frame(image_path, scene_num, video_size, present)
 
-        # Create background and composite
-        bg_clip = ColorClip(size=video_size, color=(0, 0, 0)).set_duration(scene_duration)
-        final_clip = CompositeVideoClip([bg_clip, img_clip])
+    # Guard: the stream-copy concat needs every scene piped at exactly video_size
+    if len(frame_bytes) != target_width * target_height * 3:
+        raise ValueError(f"Scene {scene_num} frame does not match {target_width}x{target_height}")
 
-        if audio_clip:
-            final_clip = final_clip.set_audio(audio_clip)
+    # Probe audio duration so the looped still frame stops with the narration
+    if _file_exists(audio_path, present):
+        try:
+            scene_duration = max(_probe_duration(audio_path), 0.1)
+            has_audio = True
+            logger.info(f"Probed audio for scene {scene_num}")
+        except Exception as e:
+            logger.error(f"Failed to probe audio {audio_path}: {e}", exc_info=True)
+    else:
+        logger.warning(f"Audio not found for scene {scene_num}")
 
-        clips.append(final_clip)
-        logger.info(f"Scene {scene_num} added (duration: {scene_duration:.2f}s)")
+    if has_audio:
+        audio_input = ["-i", audio_path]
+    else:
+        # The scenes are joined with a stream copy, which needs every scene to carry
+        # an audio track with the same layout, so silent scenes get one too.
+        audio_input = ["-f", "lavfi", "-i", "anullsrc=r=44100:cl=stereo"]
 
-    if not clips:
-        logger.error("No valid clips found.")
-        return None
+    # The raw frame is piped to ffmpeg exactly once, converted to YUV once and then
+    # repeated in memory by the loop filter, so nothing is written to disk or
+    # re-decoded per output frame. -tune stillimage lets x264 skip motion search, and
+    # frame-based threading (sliced-threads=0) gives better throughput than slices.
+    # Audio is transcoded to AAC here too, in the same parallel per-scene pass, with
+    # fixed parameters so the final concat can stream-copy both tracks.
+    subprocess.run(
+        [FFMPEG_BINARY, "-y", "-v", "error",
+         "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{target_width}x{target_height}",
+         "-framerate", str(fps), "-i", "pipe:0",
+         *audio_input,
+         "-vf", "format=yuv420p,loop=loop=-1:size=1:start=0",
+         "-t", f"{scene_duration:.3f}",
+         "-c:v", "libx264", "-preset", "veryfast", "-tune", "stillimage",
+         "-x264-params", "sliced-threads=0", "-threads", str(threads),
+         "-c:a", "aac", "-b:a", "128k", "-ar", "44100", "-ac", "2",
+         scene_path],
+        input=frame_bytes,
+        check=True
+    )
 
-    output_path = os.path.join(project_dir, output_filename)
+    logger.info(f"Scene {scene_num} encoded (duration: {scene_duration:.2f}s)")
+    return scene_path
 
+def concat_scenes(project_dir: str, scene_paths: list[str], output_path: str):
+    """Joins the per-scene MP4s with ffmpeg's concat demuxer, copying the streams without re-encoding."""
+    list_path = os.path.join(project_dir, "concat_list.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        for scene_path in scene_paths:
+            f.write(f"file '{os.path.basename(scene_path)}'\n")
     try:
-        logger.info("Concatenating video...")
-        final_video = concatenate_videoclips(clips, method="compose")
-
-        logger.info(f"Exporting video to {output_path}...")
-        final_video.write_videofile(
-            output_path,
-            fps=fps,
-            codec="libx264",
-            audio_codec="aac",
-            temp_audiofile=os.path.join(project_dir, "temp_audio.m4a"),
-            remove_temp=True,
-            threads=4,
-            preset='ultrafast',
-            logger='bar'  # ✅ Enables default progress bar
+        subprocess.run(
+            [FFMPEG_BINARY, "-y", "-v", "error", "-f", "concat", "-safe", "0",
+             "-i", list_path, "-c", "copy", output_path],
+            check=True
         )
+    finally:
+        os.remove(list_path)
 
-        logger.info(f"Video saved at {output_path}")
-        return output_path
+class SceneEncoder:
+    """
+    Encodes scenes in the background as they are submitted and joins them into the
+    final video, so encoding can overlap with generating the remaining scenes' assets.
+    """
 
-    except Exception as e:
-        logger.error(f"Video generation failed: {e}", exc_info=True)
-        return None
+    def __init__(self, project_dir: str, max_workers: int = 4):
+        self.project_dir = project_dir
+        # Split the cores between the concurrent encoders instead of letting each
+        # one start a thread per core.
+        self._threads = max(1, (os.cpu_count() or 1) // max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures: dict[int, Future] = {}
+        self._closed = False
+        # submit() may be called from several asset-generation threads at once
+        self._lock = Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def submit(self, scene_num: int, present: set[str] | None = None):
+        """
+        Starts encoding a scene whose image and audio files are complete.
+        `present` is the set of file names known to exist in the project directory;
+        if omitted, the scene's files are looked up on disk.
+        """
+        with self._lock:
+            if not self._closed and scene_num not in self._futures:
+                self._futures[scene_num] = self._executor.submit(
+                    encode_scene, self.project_dir, scene_num, VIDEO_SIZE, FPS, self._threads, present)
+
+    def finish(self, output_filename: str = "final_video.mp4") -> str | None:
+        """
+        Waits for all submitted scenes and joins them, in scene order, into the final video.
+        If any scene fails to encode, no video is produced rather than one with a scene missing.
+
+        Returns:
+            Path to the saved final video file, or None if generation fails.
+        """
+        output_path = os.path.join(self.project_dir, output_filename)
+        self._executor.shutdown(wait=True)
 
-    finally:
-        for clip in clips:
-            try:
-                clip.close()
-                if clip.audio:
-                    clip.audio.close()
-            except Exception as e:
-                logger.warning(f"Error closing clip: {e}")
         try:
-            if 'final_video' in locals():
-                final_video.close()
+            scene_paths = []
+            failed_scenes = []
+            for scene_num in sorted(self._futures):
+                try:
+                    scene_paths.append(self._futures[scene_num].result())
+                except Exception as e:
+                    logger.error(f"Failed to encode scene {scene_num}: {e}", exc_info=True)
+                    failed_scenes.append(scene_num)
+
+            if failed_scenes:
+                logger.error(f"Not joining the video, scenes {failed_scenes} failed to encode.")
+                return None
+
+            if not scene_paths:
+                logger.error("No valid clips found.")
+                return None
+
+            # The scenes are stream-copied into the final video, so no frame is
+            # rendered or encoded twice.
+            logger.info(f"Concatenating scenes into {output_path}...")
+            concat_scenes(self.project_dir, scene_paths, output_path)
+
+            logger.info(f"Video saved at {output_path}")
+            return output_path
+
         except Exception as e:
-            logger.warning(f"Error closing final video: {e}")
+            logger.error(f"Video generation failed: {e}", exc_info=True)
+            return None
+
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stops the encoder: scenes that have not started are cancelled, running encodes
+        are waited for, and all per-scene MP4s are removed. Safe to call more than once.
+        """
+        with self._lock:
+            self._closed = True
+            scene_nums = list(self._futures)
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        for scene_num in scene_nums:
+            try:
+                os.remove(_scene_video_path(self.project_dir, scene_num))
+            except OSError:
+                pass
+
+def generate_video(project_dir: str, scene_numbers: list[int], output_filename: str = "final_video.mp4") -> str | None:
+    """
+    Combines generated images and audio into a final video once all assets exist.
+    Assumes image and audio files are named 'scene_X.jpg' and 'scene_X.mp3' in project_dir.
+    
+    Returns:
+        Path to the saved final video file, or None if generation fails.
+    """
+    # All assets already exist, so one directory scan answers every scene's lookups
+    present = {entry.name for entry in os.scandir(project_dir)}
+    encoder = SceneEncoder(project_dir, max_workers=min(8, max(1, len(scene_numbers))))
+    for scene_num in scene_numbers:
+        encoder.submit(scene_num, present)
+    return encoder.finish(output_filename)
@@ -0,0 +1,3 @@
+# WSGI entry point for production servers, e.g. `gunicorn wsgi:app`
+# (worker settings are read from gunicorn.conf.py).
+from app import app